@@ -0,0 +1,292 @@
+import json
+import os
+import numpy as np
+
+# Files making up an on-disk rating matrix snapshot
+MATRIX_FILES = ('indptr', 'indices', 'data', 'col_indptr', 'col_users', 'col_data')
+
+
+class RatingMatrix(object):
+    """
+    Read-only sparse user x movie rating matrix.
+
+    Ratings are stored twice, row-wise (CSR, one row per user) and column-wise
+    (CSC, one column per movie), so that the users sharing a movie with a
+    target user can be gathered without scanning the whole matrix. Once saved,
+    the arrays are loaded with ``mmap_mode='r'`` so that every worker process
+    shares the same pages instead of holding its own copy.
+    """
+
+    def __init__(self, user_ids, movie_ids, indptr, indices, data, col_indptr, col_users, col_data):
+        self.user_ids = user_ids
+        self.movie_ids = movie_ids
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.col_indptr = col_indptr
+        self.col_users = col_users
+        self.col_data = col_data
+        self.user_index = {user_id: row for row, user_id in enumerate(user_ids.tolist())}
+        self.movie_index = {movie_id: column for column, movie_id in enumerate(movie_ids.tolist())}
+
+    @property
+    def num_users(self):
+        return len(self.user_ids)
+
+    @property
+    def num_movies(self):
+        return len(self.movie_ids)
+
+    @classmethod
+    def from_user_ratings(cls, user_ratings):
+        """
+        Build a matrix from an iterable of per-user ratings.
+
+        Args:
+        user_ratings (iterable): Pairs of (user_id, {movie_id: rating}).
+
+        Returns:
+        RatingMatrix: The in-memory rating matrix.
+        """
+        user_ids = []
+        movie_index = {}
+        row_indices = []
+        row_data = []
+        for user_id, ratings in user_ratings:
+            user_ids.append(user_id)
+            row_indices.append(np.array([movie_index.setdefault(movie_id, len(movie_index)) for movie_id in ratings],
+                                        dtype=np.int32))
+            row_data.append(np.fromiter(ratings.values(), dtype=np.float32, count=len(ratings)))
+
+        lengths = np.array([len(row) for row in row_indices], dtype=np.int64)
+        indptr = np.zeros(len(user_ids) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        indices = np.concatenate(row_indices) if row_indices else np.zeros(0, dtype=np.int32)
+        data = np.concatenate(row_data) if row_data else np.zeros(0, dtype=np.float32)
+
+        # Column-wise copy, ordered by movie and then by user
+        order = np.argsort(indices, kind='stable')
+        col_indptr = np.zeros(len(movie_index) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(indices, minlength=len(movie_index)), out=col_indptr[1:])
+        rows = np.repeat(np.arange(len(user_ids), dtype=np.int32), lengths)
+        col_users = rows[order]
+        col_data = data[order]
+
+        return cls(np.array(user_ids, dtype=str), np.array(list(movie_index), dtype=str),
+                   indptr, indices, data, col_indptr, col_users, col_data)
+
+    @classmethod
+    def from_redis(cls, redis_client, batch_size=1000):
+        """
+        Build a matrix from the ``ratings:*`` sorted sets in Redis.
+
+        Args:
+        redis_client (Redis): The Redis client to read from.
+        batch_size (int): Number of users fetched per pipeline round trip.
+
+        Returns:
+        RatingMatrix: The in-memory rating matrix.
+        """
+        def iter_ratings():
+            # SCAN may return a key more than once, which would duplicate the user's row
+            seen = set()
+            keys = []
+            for key in redis_client.scan_iter(match='ratings:*', count=batch_size):
+                if key in seen:
+                    continue
+                seen.add(key)
+                keys.append(key)
+                if len(keys) == batch_size:
+                    yield from fetch(keys)
+                    keys = []
+            yield from fetch(keys)
+
+        def fetch(keys):
+            pipeline = redis_client.pipeline()
+            for key in keys:
+                pipeline.zrange(key, 0, -1, withscores=True)
+            for key, ratings in zip(keys, pipeline.execute()):
+                # Skip the {0: 0} placeholder written by create_user
+                yield key.decode().split(':')[1], {movie_id.decode(): rating for movie_id, rating in ratings
+                                                   if movie_id != b'0'}
+
+        return cls.from_user_ratings(iter_ratings())
+
+    def save(self, directory):
+        """
+        Write the matrix to a directory as ``.npy`` files.
+
+        Args:
+        directory (str): The directory to write to; created if missing.
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name in MATRIX_FILES:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(directory, 'ids.json'), 'w', encoding='utf-8') as file:
+            json.dump({'users': self.user_ids.tolist(), 'movies': self.movie_ids.tolist()}, file)
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Memory-map a matrix previously written with ``save``.
+
+        Args:
+        directory (str): The directory the matrix was saved to.
+
+        Returns:
+        RatingMatrix: A read-only, memory-mapped rating matrix.
+        """
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r') for name in MATRIX_FILES}
+        with open(os.path.join(directory, 'ids.json'), encoding='utf-8') as file:
+            ids = json.load(file)
+        return cls(np.array(ids['users'], dtype=str), np.array(ids['movies'], dtype=str), **arrays)
+
+    def user_row(self, row):
+        """
+        Return the movie columns and ratings of one user.
+
+        Args:
+        row (int): The user's row in the matrix.
+
+        Returns:
+        tuple: Arrays of movie columns and ratings.
+        """
+        start, end = self.indptr[row], self.indptr[row + 1]
+        return self.indices[start:end], self.data[start:end]
+
+    def similar_users(self, row, num_neighbors=10):
+        """
+        Find the users most similar to a user, vectorized over all candidates.
+
+        Uses the same Pearson correlation over commonly rated movies as
+        ``calculate_similarity``, computed only for users that share at least
+        one movie with the target.
+
+        Unlike ``get_similar_users``, which keeps the top neighbors whatever
+        their sign, only positively correlated users are kept, deliberately:
+        users with no correlation add nothing but zero scores, and negatively
+        correlated ones would push down the movies they rated highly instead
+        of recommending what similar users liked.
+
+        Args:
+        row (int): The target user's row in the matrix.
+        num_neighbors (int): Maximum number of neighbors to return.
+
+        Returns:
+        tuple: Arrays of neighbor rows and their (positive) similarity scores.
+        """
+        movies, ratings = self.user_row(row)
+        positions, lengths = _gather(self.col_indptr, movies)
+        if not len(positions):
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        others = self.col_users[positions]
+        x = np.repeat(ratings.astype(np.float64), lengths)
+        y = self.col_data[positions].astype(np.float64)
+
+        # Dense per-user sums: no sort of the co-raters and O(num_users) memory
+        n = np.bincount(others, minlength=self.num_users)
+        candidates = np.flatnonzero(n)
+        n = n[candidates]
+        sum_x = np.bincount(others, weights=x, minlength=self.num_users)[candidates]
+        sum_y = np.bincount(others, weights=y, minlength=self.num_users)[candidates]
+        sum_xx = np.bincount(others, weights=x * x, minlength=self.num_users)[candidates]
+        sum_yy = np.bincount(others, weights=y * y, minlength=self.num_users)[candidates]
+        sum_xy = np.bincount(others, weights=x * y, minlength=self.num_users)[candidates]
+        size = len(candidates)
+
+        numerator = sum_xy - sum_x * sum_y / n
+        denominator = np.sqrt(np.clip((sum_xx - sum_x ** 2 / n) * (sum_yy - sum_y ** 2 / n), 0, None))
+        similarity = np.divide(numerator, denominator, out=np.zeros(size), where=denominator > 0)
+
+        keep = (candidates != row) & (similarity > 0)
+        candidates, similarity = candidates[keep], similarity[keep]
+        top = _top_k(similarity, num_neighbors)
+        return candidates[top].astype(np.int64), similarity[top]
+
+    def recommend(self, row, num_recommendations=5, num_neighbors=10):
+        """
+        Recommend movies to a user from the ratings of similar users.
+
+        Scores each unseen movie like ``recommend_movies``, with the sum of
+        similarity * rating over the user's nearest neighbors, but draws only on
+        positively correlated neighbors (see ``similar_users``), so results can
+        differ from the live path for users with few such neighbors.
+
+        Args:
+        row (int): The user's row in the matrix.
+        num_recommendations (int): The number of recommendations to generate.
+        num_neighbors (int): The number of similar users to draw from.
+
+        Returns:
+        list: Tuples of recommended movie IDs and their scores, best first.
+        """
+        neighbors, similarity = self.similar_users(row, num_neighbors)
+        positions, lengths = _gather(self.indptr, neighbors)
+        if not len(positions):
+            return []
+
+        movies = self.indices[positions]
+        weights = np.repeat(similarity, lengths) * self.data[positions]
+        candidates, inverse = np.unique(movies, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights, minlength=len(candidates))
+
+        unseen = ~np.isin(candidates, self.user_row(row)[0])
+        candidates, scores = candidates[unseen], scores[unseen]
+        top = _top_k(scores, num_recommendations)
+        return [(self.movie_ids[movie], float(score)) for movie, score in zip(candidates[top], scores[top])]
+
+    def predict(self, row, movie_ids, num_neighbors=10):
+        """
+        Predict a user's ratings as the similarity-weighted average rating of
+        the neighbors who rated each movie.
+
+        Args:
+        row (int): The user's row in the matrix.
+        movie_ids (list): The movie IDs to predict ratings for.
+        num_neighbors (int): The number of similar users to draw from.
+
+        Returns:
+        ndarray: Predicted ratings, NaN where no neighbor rated the movie.
+        """
+        columns = np.array([self.movie_index.get(movie_id, -1) for movie_id in movie_ids], dtype=np.int64)
+        neighbors, similarity = self.similar_users(row, num_neighbors)
+        positions, lengths = _gather(self.indptr, neighbors)
+        movies = self.indices[positions]
+        weights = np.repeat(similarity, lengths)
+
+        numerator = np.bincount(movies, weights=weights * self.data[positions], minlength=self.num_movies)
+        denominator = np.bincount(movies, weights=weights, minlength=self.num_movies)
+        known = columns >= 0
+        numerator = np.where(known, numerator[columns], 0.0)
+        denominator = np.where(known, denominator[columns], 0.0)
+        return np.divide(numerator, denominator, out=np.full(len(columns), np.nan), where=denominator > 0)
+
+
+def _gather(indptr, slices):
+    """
+    Concatenate the positions of several ``indptr`` slices without a Python loop.
+
+    Args:
+    indptr (ndarray): Slice boundaries of a CSR or CSC array.
+    slices (ndarray): The rows (or columns) to gather.
+
+    Returns:
+    tuple: Flat positions into the underlying arrays and the length of each slice.
+    """
+    starts = np.asarray(indptr[slices], dtype=np.int64)
+    lengths = np.asarray(indptr[np.asarray(slices) + 1], dtype=np.int64) - starts
+    offsets = np.cumsum(lengths) - lengths
+    positions = np.arange(lengths.sum()) - np.repeat(offsets - starts, lengths)
+    return positions, lengths
+
+
+def _top_k(values, k):
+    """
+    Return the indices of the ``k`` largest values, largest first.
+    """
+    if len(values) > k:
+        top = np.argpartition(-values, k)[:k]
+    else:
+        top = np.arange(len(values))
+    return top[np.argsort(-values[top], kind='stable')]
@@ -1,21 +1,24 @@
 import redis
 import json
 import math
+import time
 from collections import defaultdict
 from app.__init__ import redis_client
 
 # Function to get user ratings
-def get_user_ratings(user_id):
+def get_user_ratings(user_id, client=None):
     """
     Retrieve the ratings given by a specific user.
 
     Args:
     user_id (str): The ID of the user.
+    client (Redis): The Redis client to read from; defaults to the application's.
 
     Returns:
     dict: A dictionary of movie IDs and their corresponding ratings given by the user.
     """
-    ratings = redis_client.zrange(f"ratings:{user_id}", 0, -1, withscores=True)
+    client = redis_client if client is None else client
+    ratings = client.zrange(f"ratings:{user_id}", 0, -1, withscores=True)
     return {movie_id.decode(): rating for movie_id, rating in ratings}
 
 
@@ -66,7 +69,7 @@ def calculate_similarity(user1_ratings, user2_ratings, similarity_cache):
     return similarity_score
 
 # Function to get similar users
-def get_similar_users(target_user_id, user_ids, similarity_cache):
+def get_similar_users(target_user_id, user_ids, similarity_cache, client=None):
     """
     Find users similar to a specified target user.
 
@@ -74,15 +77,16 @@ def get_similar_users(target_user_id, user_ids, similarity_cache):
     target_user_id (str): The target user's ID.
     user_ids (list): List of user IDs to compare with the target user.
     similarity_cache (dict): Cache to store computed similarity scores.
+    client (Redis): The Redis client to read from; defaults to the application's.
 
     Returns:
     list: A list of tuples containing similar user IDs and their similarity scores.
     """
-    target_ratings = get_user_ratings(target_user_id)
+    target_ratings = get_user_ratings(target_user_id, client)
     similar_users = []
     for user_id in user_ids:
         if user_id != f"ratings:{target_user_id}":
-            other_user_ratings = get_user_ratings(user_id.decode('utf-8').split(":")[1]) 
+            other_user_ratings = get_user_ratings(user_id.decode('utf-8').split(":")[1], client)
             similarity = calculate_similarity(target_ratings, other_user_ratings, similarity_cache)
             similar_users.append((user_id, similarity))
 
@@ -100,21 +104,23 @@ def get_title_from_ids(movie_ids):
             recommended_movie_titles.append(movie_title.decode('utf-8'))
     return recommended_movie_titles
 
-# Function to recommend movies
-def recommend_movies(user_id, num_recommendations=5):
+# Function to recommend movie IDs
+def recommend_movie_ids(user_id, num_recommendations=5, client=None):
     """
     Recommend movies to a user based on the ratings of similar users.
 
     Args:
     user_id (str): The user ID for whom the recommendation is to be made.
     num_recommendations (int): The number of recommendations to generate.
+    client (Redis): The Redis client to read ratings from; defaults to the application's.
 
     Returns:
     list: A list of movie IDs recommended for the user.
     """
+    client = redis_client if client is None else client
     similarity_cache = {}  # Initialize an in-memory cache for similarity scores
-    user_ids = redis_client.keys('ratings:*')
-    similar_users = get_similar_users(user_id, user_ids, similarity_cache)
+    user_ids = client.keys('ratings:*')
+    similar_users = get_similar_users(user_id, user_ids, similarity_cache, client)
     movie_scores = defaultdict(float)
 
     for similar_user, similarity in similar_users:
@@ -123,19 +129,55 @@ def recommend_movies(user_id, num_recommendations=5):
         # Ensure user_id is a string if necessary
         user_id_str = user_id if isinstance(user_id, str) else user_id.decode('utf-8')
         if similar_user_id != user_id_str:
-            other_user_ratings = get_user_ratings(similar_user_id)
+            other_user_ratings = get_user_ratings(similar_user_id, client)
             for movie_id, rating in other_user_ratings.items():
                 # Ensure movie_id is a string if necessary
                 movie_id_str = movie_id if isinstance(movie_id, str) else movie_id.decode('utf-8')
-                if movie_id_str not in get_user_ratings(user_id_str):
+                if movie_id_str not in get_user_ratings(user_id_str, client):
                     movie_scores[movie_id_str] += similarity * rating
 
     # Sort the movie scores and select the top recommendations
     sorted_scores = sorted(movie_scores.items(), key=lambda x: x[1], reverse=True)
-    recommended_movie_ids = [movie for movie, _ in sorted_scores[:num_recommendations]]
+    return [movie for movie, _ in sorted_scores[:num_recommendations]]
+
+# Function to recommend movies
+def recommend_movies(user_id, num_recommendations=5):
+    """
+    Recommend movies to a user based on the ratings of similar users.
+
+    Args:
+    user_id (str): The user ID for whom the recommendation is to be made.
+    num_recommendations (int): The number of recommendations to generate.
+
+    Returns:
+    list: A list of movie titles recommended for the user.
+    """
+    recommended_movie_ids = recommend_movie_ids(user_id, num_recommendations)
     recommended_movie_titles = get_title_from_ids(recommended_movie_ids)
     return recommended_movie_titles
 
+# Function to get recommendations precomputed by batch_scoring.py
+def get_cached_recommendations(user_id, num_recommendations=5):
+    """
+    Retrieve the recommendations stored for a user by the offline batch scoring.
+
+    Args:
+    user_id (str): The user ID whose recommendations are to be retrieved.
+    num_recommendations (int): The number of recommendations to retrieve.
+
+    Returns:
+    list: A list of recommended movie titles, empty if none are stored or the
+    user has rated a movie since they were computed.
+    """
+    pipeline = redis_client.pipeline()
+    pipeline.zrevrange(f"recommendations:{user_id}", 0, num_recommendations - 1)
+    pipeline.hget('recommendations_created', user_id)
+    pipeline.hget('ratings_updated', user_id)
+    movie_ids, created, rated = pipeline.execute()
+    if rated is not None and (created is None or float(rated) >= float(created)):
+        return []
+    return get_title_from_ids([movie_id.decode('utf-8') for movie_id in movie_ids])
+
 def add_user_rating(user_id, content_id, rating):
     """
     Add a user's rating for a movie and update the recommendations.
@@ -148,5 +190,11 @@ def add_user_rating(user_id, content_id, rating):
     # Add or update the user's rating
     redis_client.zadd(f"ratings:{user_id}", {content_id: rating})
 
+    # Drop the precomputed recommendations, they no longer reflect the user's ratings.
+    # A batch run already in progress may still write a set computed from an older
+    # snapshot; the rating time makes get_cached_recommendations ignore it.
+    redis_client.hset('ratings_updated', user_id, time.time())
+    redis_client.delete(f"recommendations:{user_id}")
+
     # Trigger an update to the user's recommendations
     recommend_movies(user_id)
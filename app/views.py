@@ -1,6 +1,6 @@
 from flask import Flask, render_template, request, redirect, url_for
 from flask_bootstrap import Bootstrap
-from app.recommendations import recommend_movies, add_user_rating
+from app.recommendations import recommend_movies, get_cached_recommendations, add_user_rating
 from app.models import get_user, get_all_users
 import random
 from . import app, Bootstrap
@@ -22,7 +22,7 @@ def index():
     try:
         user_data = get_user(user_id) if user_id else None
         # print(user_data)
-        recommendations = recommend_movies(user_id) if user_id else []
+        recommendations = (get_cached_recommendations(user_id) or recommend_movies(user_id)) if user_id else []
         top_rated_movies = get_top_rated_movies_for_user(user_id) if user_id else []
     except Exception as e:
         # Log the exception and return an error message
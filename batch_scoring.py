@@ -0,0 +1,176 @@
+import argparse
+import json
+import os
+import shutil
+import time
+from multiprocessing import Pool
+from redis.exceptions import RedisError
+from app.__init__ import redis_client
+from app.rating_matrix import RatingMatrix
+
+# Offline batch scoring of every user in ratings:*.
+#
+# The ratings are snapshotted once into a memory-mapped RatingMatrix under the
+# work directory, the users are split into fixed shards and the shards are
+# scored on a process pool. Finished shards are checkpointed as marker files,
+# so re-running the same command after a crash only scores what is left.
+
+MANIFEST_FILE = 'manifest.json'
+MATRIX_DIR = 'matrix'
+SHARDS_DIR = 'shards'
+
+# Per-process state, set up once by init_worker
+worker_matrix = None
+
+
+def init_worker(matrix_dir):
+    global worker_matrix
+    worker_matrix = RatingMatrix.load(matrix_dir)
+
+
+def score_shard(task):
+    """
+    Score every user of a shard and store the results in Redis.
+
+    Args:
+    task (tuple): (shard_id, first_row, last_row, num_recommendations, num_neighbors, batch_size, created).
+
+    Returns:
+    tuple: The shard ID and the number of users scored.
+    """
+    shard_id, first_row, last_row, num_recommendations, num_neighbors, batch_size, created = task
+    pipeline = redis_client.pipeline()
+    for count, row in enumerate(range(first_row, last_row), start=1):
+        user_id = worker_matrix.user_ids[row]
+        key = f"recommendations:{user_id}"
+        recommendations = worker_matrix.recommend(row, num_recommendations, num_neighbors)
+        pipeline.delete(key)
+        if recommendations:
+            pipeline.zadd(key, dict(recommendations))
+            # Lets get_cached_recommendations ignore sets older than the user's last rating
+            pipeline.hset('recommendations_created', user_id, created)
+        if count % batch_size == 0:
+            pipeline.execute()
+            pipeline = redis_client.pipeline()
+    pipeline.execute()
+    return shard_id, last_row - first_row
+
+
+def shard_marker(workdir, shard_id):
+    return os.path.join(workdir, SHARDS_DIR, f"{shard_id:06d}.done")
+
+
+def prepare(workdir, shard_size, fresh):
+    """
+    Snapshot the ratings into the work directory, or reuse a previous snapshot.
+
+    Args:
+    workdir (str): The directory holding the snapshot and checkpoints.
+    shard_size (int): Number of users per shard for a new run.
+    fresh (bool): Discard any previous run and start over.
+
+    Returns:
+    dict: The run manifest.
+    """
+    manifest_path = os.path.join(workdir, MANIFEST_FILE)
+    if os.path.exists(manifest_path) and not fresh:
+        with open(manifest_path, encoding='utf-8') as file:
+            manifest = json.load(file)
+        if manifest['shard_size'] != shard_size:
+            print(f"Resuming with the shard size of the previous run ({manifest['shard_size']})")
+        return manifest
+
+    # Invalidate the previous run before touching its checkpoints or matrix
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    os.makedirs(os.path.join(workdir, SHARDS_DIR), exist_ok=True)
+    for name in os.listdir(os.path.join(workdir, SHARDS_DIR)):
+        os.remove(os.path.join(workdir, SHARDS_DIR, name))
+
+    print("Snapshotting ratings...")
+    matrix_dir = os.path.join(workdir, MATRIX_DIR)
+    # Taken before reading, so ratings added during the snapshot count as newer
+    created = time.time()
+    matrix = RatingMatrix.from_redis(redis_client)
+    shutil.rmtree(matrix_dir + '.tmp', ignore_errors=True)
+    matrix.save(matrix_dir + '.tmp')
+    shutil.rmtree(matrix_dir, ignore_errors=True)
+    os.replace(matrix_dir + '.tmp', matrix_dir)
+    manifest = {
+        'num_users': matrix.num_users,
+        'num_movies': matrix.num_movies,
+        'num_ratings': int(matrix.indptr[-1]),
+        'shard_size': shard_size,
+        'num_shards': -(-matrix.num_users // shard_size),
+        'created': created,
+    }
+    # Write the manifest last and atomically: its presence marks a usable snapshot
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(manifest, file)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    print(f"Snapshot: {manifest['num_users']} users, {manifest['num_movies']} movies, "
+          f"{manifest['num_ratings']} ratings in {manifest['num_shards']} shards")
+    return manifest
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:d}:{minutes:02d}:{seconds:02d}"
+
+
+def run(workdir, workers, shard_size, num_recommendations, num_neighbors, batch_size, fresh):
+    manifest = prepare(workdir, shard_size, fresh)
+    shard_size, num_users = manifest['shard_size'], manifest['num_users']
+    tasks = []
+    for shard_id in range(manifest['num_shards']):
+        if not os.path.exists(shard_marker(workdir, shard_id)):
+            first_row = shard_id * shard_size
+            last_row = min(first_row + shard_size, num_users)
+            tasks.append((shard_id, first_row, last_row, num_recommendations, num_neighbors, batch_size,
+                          manifest['created']))
+
+    remaining = sum(task[2] - task[1] for task in tasks)
+    print(f"Scoring {remaining} users in {len(tasks)} shards "
+          f"({manifest['num_shards'] - len(tasks)} shards already done) with {workers} workers...")
+    if not tasks:
+        return
+
+    scored = 0
+    started = time.time()
+    with Pool(workers, initializer=init_worker, initargs=(os.path.join(workdir, MATRIX_DIR),)) as pool:
+        for done, (shard_id, num_scored) in enumerate(pool.imap_unordered(score_shard, tasks), start=1):
+            open(shard_marker(workdir, shard_id), 'w').close()
+            scored += num_scored
+            elapsed = time.time() - started
+            rate = scored / elapsed if elapsed else 0.0
+            eta = (remaining - scored) / rate if rate else 0.0
+            print(f"[{done}/{len(tasks)} shards] {scored}/{remaining} users, "
+                  f"{rate:.1f} users/sec, elapsed {format_duration(elapsed)}, ETA {format_duration(eta)}")
+    print("Batch scoring complete.")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate recommendations for every user in ratings:* and store them in "
+                    "recommendations:<user_id>. Re-run the same command to resume an interrupted run.")
+    parser.add_argument('--workdir', default='batch_scoring',
+                        help="Directory for the rating snapshot and shard checkpoints")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument('--shard-size', type=int, default=1000, help="Users per shard")
+    parser.add_argument('--num-recommendations', type=int, default=5, help="Recommendations stored per user")
+    parser.add_argument('--neighbors', type=int, default=10, help="Similar users considered per user")
+    parser.add_argument('--batch-size', type=int, default=1000, help="Users written per Redis pipeline")
+    parser.add_argument('--fresh', action='store_true',
+                        help="Discard the previous snapshot and checkpoints and start over")
+    args = parser.parse_args()
+
+    try:
+        run(args.workdir, args.workers, args.shard_size, args.num_recommendations, args.neighbors,
+            args.batch_size, args.fresh)
+    except RedisError as e:
+        print(f"Error during batch scoring: {e}")
+
+
+if __name__ == '__main__':
+    main()
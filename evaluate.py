@@ -0,0 +1,397 @@
+import argparse
+import importlib
+import json
+import os
+import random
+import tempfile
+import time
+from multiprocessing import Pool
+import numpy as np
+from redis import Redis
+from app.rating_matrix import RatingMatrix
+from config import Config
+
+# Offline evaluation of recommender backends.
+#
+# The ratings are split by time: everything before a cutoff timestamp is the
+# training set, everything after it is held out. Each backend is built from the
+# training set and asked for recommendations for a sample of users that have
+# ratings on both sides of the cutoff; its recommendations are scored against
+# the held-out ratings and its latency is measured per user, so that a faster
+# backend can be checked for lost recommendation quality in the same report.
+
+ratings_file_path = 'app/static/ml-25m/ratings.csv'
+
+
+class NeighborsBackend(object):
+    """
+    Pearson nearest-neighbor recommender on the in-memory training matrix.
+    """
+
+    def __init__(self, train, redis_url=None, num_neighbors=10):
+        self.train = train
+        self.num_neighbors = num_neighbors
+
+    def recommend(self, user_id, num_recommendations):
+        row = self.train.user_index[user_id]
+        return [movie_id for movie_id, _ in self.train.recommend(row, num_recommendations, self.num_neighbors)]
+
+    def predict(self, user_id, movie_ids):
+        return self.train.predict(self.train.user_index[user_id], movie_ids, self.num_neighbors)
+
+
+class RedisBackend(object):
+    """
+    The live ``recommend_movie_ids`` path, reading ratings from Redis.
+
+    It runs against the separate database that ``load_train_into_redis``
+    fills with the training split, so held-out ratings neither leak into the
+    recommendations nor get excluded from them as already rated. It does not
+    predict ratings, so no RMSE is reported for it.
+    """
+
+    def __init__(self, train, redis_url):
+        from app.recommendations import recommend_movie_ids
+        self.recommend_movie_ids = recommend_movie_ids
+        self.client = Redis.from_url(redis_url)
+
+    def recommend(self, user_id, num_recommendations):
+        return self.recommend_movie_ids(user_id, num_recommendations, self.client)
+
+
+# Built-in backends, each constructed with (train, redis_url)
+BACKENDS = {
+    'neighbors': NeighborsBackend,
+    'redis': RedisBackend,
+}
+
+
+def load_backend(name, train, redis_url=None):
+    """
+    Build a backend by name, or from a ``module:factory`` path.
+
+    Built-in backends are constructed with the training RatingMatrix and the
+    Redis URL, a ``module:factory`` with the training RatingMatrix only. Either
+    must return an object with a ``recommend(user_id, num_recommendations)``
+    method returning movie IDs, and optionally a ``predict(user_id, movie_ids)``
+    method returning predicted ratings (NaN where unknown).
+
+    Args:
+    name (str): A key of BACKENDS or a ``module:factory`` path.
+    train (RatingMatrix): The training split.
+    redis_url (str): The Redis database holding the training split, for the redis backend.
+
+    Returns:
+    object: The backend.
+    """
+    if name in BACKENDS:
+        return BACKENDS[name](train, redis_url)
+    module_name, _, factory_name = name.partition(':')
+    if not factory_name:
+        raise ValueError(f"Unknown backend {name!r}, expected one of {sorted(BACKENDS)} or module:factory")
+    return getattr(importlib.import_module(module_name), factory_name)(train)
+
+
+def read_ratings_csv(filepath):
+    """
+    Read a MovieLens ratings CSV straight into column arrays.
+
+    User and movie IDs are kept as integers here and only turned into the
+    string IDs used as Redis keys per user, which keeps ml-25m in a few
+    hundred MB.
+
+    Args:
+    filepath (str): Path to ratings.csv.
+
+    Returns:
+    tuple: Arrays of user IDs, movie IDs, ratings and timestamps.
+    """
+    columns = [('userId', np.int64), ('movieId', np.int64), ('rating', np.float64), ('timestamp', np.int64)]
+    return np.loadtxt(filepath, delimiter=',', skiprows=1, dtype=columns, unpack=True, ndmin=1)
+
+
+def redis_database(client):
+    """
+    Identify the database a client connects to, however its URL was spelled.
+
+    Args:
+    client (Redis): The Redis client.
+
+    Returns:
+    tuple: The socket path, or the host, port and database number.
+    """
+    settings = client.connection_pool.connection_kwargs
+    if settings.get('path'):
+        return settings['path'], int(settings.get('db') or 0)
+    host = settings.get('host', 'localhost')
+    if host in ('localhost', '127.0.0.1', '::1'):
+        host = 'localhost'
+    return host, int(settings.get('port') or 6379), int(settings.get('db') or 0)
+
+
+def load_train_into_redis(train, redis_url, batch_size=1000):
+    """
+    Replace the ``ratings:*`` sorted sets of a Redis database with the training split.
+
+    Args:
+    train (RatingMatrix): The training split.
+    redis_url (str): The Redis database to write to; must not be the application's.
+    batch_size (int): Number of commands per pipeline round trip.
+    """
+    client = Redis.from_url(redis_url)
+    if redis_database(client) == redis_database(Redis.from_url(Config.REDIS_URL)):
+        raise ValueError(f"Refusing to overwrite the application database {redis_url}, pass another --redis-url")
+    for key in client.scan_iter(count=batch_size):
+        if not key.startswith(b'ratings:'):
+            raise ValueError(f"Refusing to overwrite {redis_url}, it holds other data such as {key.decode()!r}; "
+                             f"pass an empty or scratch --redis-url")
+
+    pipeline = client.pipeline()
+    for count, key in enumerate(client.scan_iter(match='ratings:*', count=batch_size), start=1):
+        pipeline.delete(key)
+        if count % batch_size == 0:
+            pipeline.execute()
+            pipeline = client.pipeline()
+    pipeline.execute()
+
+    pipeline = client.pipeline()
+    for row, user_id in enumerate(train.user_ids.tolist(), start=1):
+        movies, ratings = train.user_row(row - 1)
+        pipeline.zadd(f"ratings:{user_id}", dict(zip(train.movie_ids[movies].tolist(), ratings.tolist())))
+        if row % batch_size == 0:
+            pipeline.execute()
+            pipeline = client.pipeline()
+    pipeline.execute()
+
+
+def time_split(user_ids, movie_ids, ratings, timestamps, test_fraction=0.2):
+    """
+    Split ratings at the timestamp leaving ``test_fraction`` of them after it.
+
+    Args:
+    user_ids (ndarray): User ID of each rating.
+    movie_ids (ndarray): Movie ID of each rating.
+    ratings (ndarray): Rating values.
+    timestamps (ndarray): Rating timestamps.
+    test_fraction (float): Share of the most recent ratings held out.
+
+    Returns:
+    tuple: The training RatingMatrix, a boolean mask of held-out ratings and the cutoff timestamp.
+    """
+    cutoff = int(np.quantile(timestamps, 1 - test_fraction))
+    test = timestamps >= cutoff
+    train = ~test
+
+    # Group the training ratings by user to build the matrix
+    order = np.argsort(user_ids[train], kind='stable')
+    train_users, train_movies, train_ratings = user_ids[train][order], movie_ids[train][order], ratings[train][order]
+    users, starts = np.unique(train_users, return_index=True)
+    ends = np.append(starts[1:], len(train_users))
+    matrix = RatingMatrix.from_user_ratings(
+        (str(user_id), dict(zip(train_movies[start:end].astype(str).tolist(), train_ratings[start:end].tolist())))
+        for user_id, start, end in zip(users.tolist(), starts, ends))
+    return matrix, test, cutoff
+
+
+def precision_recall_ndcg(hits, num_relevant, k):
+    """
+    Compute per-user precision@K, recall@K and NDCG@K.
+
+    Args:
+    hits (ndarray): Boolean (users x K) matrix, True where the recommendation at that rank is relevant.
+    num_relevant (ndarray): Number of relevant held-out movies per user.
+    k (int): The cutoff K.
+
+    Returns:
+    tuple: Arrays of precision, recall and NDCG per user.
+    """
+    num_hits = hits.sum(axis=1)
+    precision = num_hits / k
+    recall = np.divide(num_hits, num_relevant, out=np.zeros(len(hits)), where=num_relevant > 0)
+
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    dcg = (hits * discounts).sum(axis=1)
+    ideal = np.concatenate(([0.0], np.cumsum(discounts)))[np.minimum(num_relevant, k)]
+    ndcg = np.divide(dcg, ideal, out=np.zeros(len(hits)), where=ideal > 0)
+    return precision, recall, ndcg
+
+
+def rmse(predicted, actual):
+    """
+    Root mean squared error over the pairs that have a prediction.
+
+    Args:
+    predicted (ndarray): Predicted ratings, NaN where the backend had none.
+    actual (ndarray): Actual ratings.
+
+    Returns:
+    tuple: The RMSE (NaN if nothing was predicted) and the share of pairs predicted.
+    """
+    known = ~np.isnan(predicted)
+    if not known.any():
+        return float('nan'), 0.0
+    return float(np.sqrt(np.mean((predicted[known] - actual[known]) ** 2))), float(known.mean())
+
+
+# Per-process state, set up once by init_worker
+worker_backend = None
+
+
+def init_worker(name, matrix_dir, redis_url):
+    global worker_backend
+    worker_backend = load_backend(name, RatingMatrix.load(matrix_dir), redis_url)
+
+
+def evaluate_user(task):
+    """
+    Time one recommendation call for a user and predict their held-out ratings.
+
+    Args:
+    task (tuple): (user_id, held-out movie IDs, K).
+
+    Returns:
+    tuple: The recommended movie IDs, the latency in seconds and the predictions (or None).
+    """
+    user_id, test_movie_ids, k = task
+    started = time.perf_counter()
+    recommendations = list(worker_backend.recommend(user_id, k))[:k]
+    latency = time.perf_counter() - started
+    predictions = None
+    if hasattr(worker_backend, 'predict'):
+        predictions = np.asarray(worker_backend.predict(user_id, test_movie_ids), dtype=np.float64)
+    return recommendations, latency, predictions
+
+
+def evaluate_backend(name, matrix_dir, redis_url, tasks, relevant, test_ratings, k, workers):
+    """
+    Run a backend for the sampled users and compute its quality and latency.
+
+    Args:
+    name (str): The backend to evaluate, as accepted by load_backend.
+    matrix_dir (str): Directory the training RatingMatrix was saved to.
+    redis_url (str): The Redis database holding the training split.
+    tasks (list): (user_id, held-out movie IDs, K) per sampled user.
+    relevant (list): Set of relevant held-out movie IDs per sampled user.
+    test_ratings (list): Array of held-out ratings per sampled user.
+    k (int): The cutoff K.
+    workers (int): Number of worker processes.
+
+    Returns:
+    dict: The report row for the backend.
+    """
+    started = time.time()
+    with Pool(workers, initializer=init_worker, initargs=(name, matrix_dir, redis_url)) as pool:
+        results = pool.map(evaluate_user, tasks, chunksize=max(1, len(tasks) // (workers * 4)))
+    elapsed = time.time() - started
+
+    hits = np.zeros((len(tasks), k), dtype=bool)
+    for i, ((recommendations, _, _), relevant_movies) in enumerate(zip(results, relevant)):
+        hits[i, :len(recommendations)] = [movie_id in relevant_movies for movie_id in recommendations]
+    num_relevant = np.array([len(relevant_movies) for relevant_movies in relevant], dtype=np.int64)
+    precision, recall, ndcg = precision_recall_ndcg(hits, num_relevant, k)
+    latencies = np.array([latency for _, latency, _ in results]) * 1000
+
+    error, coverage = float('nan'), 0.0
+    if all(predictions is not None for _, _, predictions in results):
+        error, coverage = rmse(np.concatenate([predictions for _, _, predictions in results]),
+                               np.concatenate(test_ratings))
+
+    return {
+        'backend': name,
+        'users': len(tasks),
+        f'precision@{k}': float(precision.mean()),
+        f'recall@{k}': float(recall.mean()),
+        f'ndcg@{k}': float(ndcg.mean()),
+        'rmse': error,
+        'rmse_coverage': coverage,
+        'latency_mean_ms': float(latencies.mean()),
+        'latency_p50_ms': float(np.percentile(latencies, 50)),
+        'latency_p95_ms': float(np.percentile(latencies, 95)),
+        'latency_p99_ms': float(np.percentile(latencies, 99)),
+        'users_per_sec': len(tasks) / elapsed if elapsed else 0.0,
+    }
+
+
+def print_report(rows):
+    columns = list(rows[0])
+    cells = [[f"{row[column]:.4f}" if isinstance(row[column], float) else str(row[column]) for column in columns]
+             for row in rows]
+    widths = [max(len(column), *(len(cell[i]) for cell in cells)) for i, column in enumerate(columns)]
+    print('  '.join(column.rjust(width) for column, width in zip(columns, widths)))
+    for cell in cells:
+        print('  '.join(value.rjust(width) for value, width in zip(cell, widths)))
+
+
+def run(filepath, backend_names, k, num_users, test_fraction, threshold, workers, seed, redis_url):
+    print("Loading ratings...")
+    user_ids, movie_ids, ratings, timestamps = read_ratings_csv(filepath)
+    train, test, cutoff = time_split(user_ids, movie_ids, ratings, timestamps, test_fraction)
+    print(f"Split at {time.strftime('%Y-%m-%d', time.gmtime(cutoff))}: "
+          f"{int((~test).sum())} training and {int(test.sum())} held-out ratings")
+
+    # Only users known at training time with something relevant to find can be scored
+    test_users, test_movies, test_values = user_ids[test], movie_ids[test], ratings[test]
+    order = np.argsort(test_users, kind='stable')
+    test_users, test_movies, test_values = test_users[order], test_movies[order], test_values[order]
+    users, starts = np.unique(test_users, return_index=True)
+    ends = np.append(starts[1:], len(test_users))
+    candidates = [(str(user_id), start, end) for user_id, start, end in zip(users.tolist(), starts, ends)
+                  if str(user_id) in train.user_index and (test_values[start:end] >= threshold).any()]
+    sample = random.Random(seed).sample(candidates, min(num_users, len(candidates)))
+    if not sample:
+        print(f"No users have both training ratings and a held-out rating of at least {threshold}, "
+              f"nothing to evaluate")
+        return []
+    print(f"Evaluating {len(sample)} of {len(candidates)} eligible users at K={k}")
+
+    tasks = [(user_id, test_movies[start:end].astype(str).tolist(), k) for user_id, start, end in sample]
+    relevant = [set(test_movies[start:end][test_values[start:end] >= threshold].astype(str).tolist())
+                for _, start, end in sample]
+    test_ratings = [test_values[start:end] for _, start, end in sample]
+
+    if 'redis' in backend_names:
+        print(f"Loading training ratings into {redis_url}...")
+        load_train_into_redis(train, redis_url)
+
+    rows = []
+    # Workers memory-map the training split instead of inheriting or unpickling it
+    with tempfile.TemporaryDirectory() as matrix_dir:
+        train.save(matrix_dir)
+        for name in backend_names:
+            print(f"Running backend {name}...")
+            rows.append(evaluate_backend(name, matrix_dir, redis_url, tasks, relevant, test_ratings, k, workers))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare recommendation quality and latency of recommender backends on a "
+                    "time-based train/test split of the ratings.")
+    parser.add_argument('--ratings', default=ratings_file_path, help="Path to the MovieLens ratings.csv")
+    parser.add_argument('--backend', action='append', dest='backends',
+                        help=f"Backend to evaluate, one of {sorted(BACKENDS)} or module:factory; "
+                             f"may be repeated (default: neighbors)")
+    parser.add_argument('-k', type=int, default=10, help="Cutoff K for precision, recall and NDCG")
+    parser.add_argument('--num-users', type=int, default=1000, help="Number of users sampled")
+    parser.add_argument('--test-fraction', type=float, default=0.2, help="Share of the most recent ratings held out")
+    parser.add_argument('--threshold', type=float, default=4.0, help="Minimum held-out rating counted as relevant")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for sampling users")
+    parser.add_argument('--redis-url', default='redis://localhost:6379/1',
+                        help="Scratch Redis database the training split is loaded into for the redis backend; "
+                             "its ratings:* keys are replaced")
+    parser.add_argument('--json', help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    rows = run(args.ratings, args.backends or ['neighbors'], args.k, args.num_users, args.test_fraction,
+               args.threshold, args.workers, args.seed, args.redis_url)
+    if not rows:
+        return
+    print_report(rows)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(rows, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()